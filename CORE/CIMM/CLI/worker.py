@@ -18,9 +18,20 @@
 #
 from argparse import ArgumentDefaultsHelpFormatter, FileType
 from configparser import ConfigParser
+from gc import freeze
+from os import fork, kill, waitpid, _exit
 from pickle import dumps
 from redis import Redis
 from rq import Connection, Worker
+from rq.defaults import DEFAULT_WORKER_TTL
+from rq.worker import WorkerStatus
+from shutil import rmtree
+from signal import signal, SIG_DFL, SIGINT, SIGTERM
+from tempfile import mkdtemp
+from time import sleep, time
+from traceback import format_exc
+from warnings import warn
+from ..models import loader, rq as runner
 
 
 def cmd(subparsers):
@@ -31,6 +42,17 @@ def cmd(subparsers):
     parser.add_argument('--redis_host', '-rh', default='localhost')
     parser.add_argument('--redis_pass', '-rp')
     parser.add_argument('--redis_port', '-rr', type=int, default=6379)
+    parser.add_argument('--models_cache', '-mc', type=int, default=0,
+                        help='amount of loaded models kept in worker. 0 - load model for each job')
+    parser.add_argument('--results_cache', '-rc', type=int, default=0,
+                        help='modeling results cache time in seconds. 0 - disable cache')
+    parser.add_argument('--pool_size', '-ps', type=int, default=0,
+                        help='amount of processes used for parallel processing of large jobs. 0 - disable')
+    parser.add_argument('--batch_size', '-bs', type=int, default=100,
+                        help='amount of structures per process in parallel processing')
+    parser.add_argument('--preload', '-pl', action='store_true',
+                        help='load all available models before start of workers')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='amount of forked workers')
 
     parser.set_defaults(func=run)
 
@@ -40,6 +62,12 @@ def run(args):
         redis_host = args.redis_host
         redis_pass = args.redis_pass
         redis_port = args.redis_port
+        models_cache = args.models_cache
+        results_cache = args.results_cache
+        pool_size = args.pool_size
+        batch_size = args.batch_size
+        preload = args.preload
+        workers = args.workers
     else:
         config = ConfigParser()
         config.read_file(args.config)
@@ -47,14 +75,149 @@ def run(args):
             redis_host = config[args.name].get('redis_host', 'localhost')
             redis_pass = config[args.name].get('redis_pass', None)
             redis_port = config[args.name].get('redis_port', 6379)
+            models_cache = config[args.name].getint('models_cache', 0)
+            results_cache = config[args.name].getint('results_cache', 0)
+            pool_size = config[args.name].getint('pool_size', 0)
+            batch_size = config[args.name].getint('batch_size', 100)
+            preload = config[args.name].getboolean('preload', False)
+            workers = config[args.name].getint('workers', 1)
         except KeyError:
             raise KeyError(f"worker '{args.name}' config not found")
 
-    with Connection(Redis(host=redis_host, port=redis_port, password=redis_pass)):
-        EventWorker([args.name]).work()
+    runner.results_cache_ttl = results_cache
+    runner.pool_size = pool_size
+    runner.batch_size = batch_size
+    if preload:
+        preload_models(models_cache)
+
+    def start():
+        with Connection(Redis(host=redis_host, port=redis_port, password=redis_pass)):
+            EventWorker([args.name], models_cache=models_cache).work()
+
+    if workers > 1:
+        fork_workers(workers, start)
+    else:
+        start()
+
+
+def preload_models(size=0):
+    """
+    load all available models into cache. loaded models shared with forked workers and jobs copy-on-write
+    """
+    models = dir(loader)
+    runner.models_cache = cache = runner.ModelsCache(max(size, len(models)))
+    for m in models:
+        print('preload: ', m)
+        workpath = mkdtemp()
+        try:
+            cache(m, workpath)
+        except:
+            warn(f'Model not found or not loadable.\n{format_exc()}', ImportWarning)
+        finally:
+            rmtree(workpath)
+    freeze()  # prevent gc from touching shared objects
+
+
+def fork_workers(workers, start):
+    """
+    fork workers and restart died workers until SIGINT or SIGTERM received
+    """
+    pids = set()
+    stopped = []
+
+    def spawn():
+        pid = fork()
+        if not pid:
+            signal(SIGINT, SIG_DFL)  # drop handlers of master inherited by respawned workers
+            signal(SIGTERM, SIG_DFL)
+            try:
+                start()
+            except:
+                warn(f'Worker crashed:\n{format_exc()}')
+                _exit(1)
+            _exit(0)
+        pids.add(pid)
+
+    def stop(signum, frame):
+        stopped.append(signum)
+        for p in pids:
+            try:
+                kill(p, signum)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        spawn()
+
+    signal(SIGINT, stop)
+    signal(SIGTERM, stop)
+    while pids:
+        try:
+            pid, _ = waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        pids.discard(pid)
+        if not stopped:
+            warn(f'Worker {pid} died. restarting')
+            sleep(respawn_delay)  # prevent fork loop of permanently broken workers
+            if not stopped:
+                spawn()
 
 
 class EventWorker(Worker):
+    """
+    worker publishes finished jobs and load statistics.
+
+    finished jobs added to cimm:done_jobs stream as {queue: queue name, job: job id} entries.
+    load statistics stored in cimm:load:{queue} hash as worker name: (busy, mean job duration, deadline) pickle.
+    """
+    def __init__(self, *args, models_cache=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        if models_cache and runner.models_cache is None:
+            runner.models_cache = runner.ModelsCache(models_cache)
+        self.__warm = bool(models_cache)
+        self.__busy = False
+        self.__duration = None
+
     def execute_job(self, job, queue):
-        super().execute_job(job, queue)
-        self.connection.publish('done_jobs', dumps((self.queues[0].name, job.id)))
+        self.__busy = True
+        start = time()
+        if self.__warm:  # fork drops loaded models. run job in worker process
+            self.set_state(WorkerStatus.BUSY)
+            self.perform_job(job, queue)
+            self.set_state(WorkerStatus.IDLE)
+        else:
+            super().execute_job(job, queue)
+        duration = time() - start
+        self.__duration = duration if self.__duration is None else .8 * self.__duration + .2 * duration
+        self.__busy = False
+        self.heartbeat()
+        self.connection.xadd('cimm:done_jobs', {'queue': self.queues[0].name, 'job': job.id},
+                             maxlen=self.stream_length, approximate=True)
+
+    def get_heartbeat_ttl(self, job):
+        if not self.__warm:
+            return super().get_heartbeat_ttl(job)
+        # job in worker process is not monitored by horse monitor. heartbeat should cover whole job execution
+        if job.timeout == -1:  # job without timeout
+            return DEFAULT_WORKER_TTL
+        return (job.timeout or DEFAULT_WORKER_TTL) + 60
+
+    def heartbeat(self, timeout=None, pipeline=None):
+        super().heartbeat(timeout, pipeline)
+        timeout = timeout or self.default_worker_ttl
+        connection = pipeline if pipeline is not None else self.connection
+        key = f'cimm:load:{self.queues[0].name}'
+        connection.hset(key, self.name, dumps((self.__busy, self.__duration, time() + timeout)))
+        # hash shared by workers of queue. expiration only extended. stale entries filtered by deadlines
+        connection.eval(_extend_ttl, 1, key, int(timeout))
+
+    def register_death(self):
+        self.connection.hdel(f'cimm:load:{self.queues[0].name}', self.name)
+        super().register_death()
+
+    stream_length = 100000
+
+
+respawn_delay = 1
+_extend_ttl = "if redis.call('ttl', KEYS[1]) < tonumber(ARGV[1]) then redis.call('expire', KEYS[1], ARGV[1]) end"
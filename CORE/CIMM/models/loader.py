@@ -17,6 +17,9 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from importlib import import_module
+from json import dump, load
+from os import getenv, replace
+from pathlib import Path
 from pkgutil import iter_modules
 from traceback import format_exc
 from warnings import warn
@@ -25,40 +28,93 @@ from .. import models
 
 def __getattr__(name):
     try:
-        return getattr(_found_models[name], name)
+        package = _found_models[name]
     except KeyError:
         raise AttributeError(f"model '{name}' not found")
 
+    try:
+        module = import_module(f'{__package__}.{package}')
+    except:
+        warn(f'{package} consist errors:\n {format_exc()}', ImportWarning)
+        raise AttributeError(f"model '{name}' not loadable")
+    return getattr(module, name)
+
 
 def __dir__():
     return list(_found_models)
 
 
+def _package_mtime(module_info):
+    path = Path(module_info.module_finder.path) / module_info.name
+    try:
+        return max(x.stat().st_mtime for x in path.iterdir() if x.name != '__pycache__')
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def _load_manifest():
+    try:
+        with _manifest.open() as f:
+            return load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    tmp = _manifest.with_name(f'{_manifest.name}.tmp')
+    try:
+        _manifest.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open('w') as f:
+            dump(manifest, f)
+        replace(tmp, _manifest)
+    except OSError:
+        warn(f'models manifest {_manifest} not writable', ImportWarning)
+
+
 def _scan_models():
+    """
+    find models in CIMM.models packages.
+
+    names of models are taken from manifest cache. packages imported only if changed or not cached.
+    """
+    cached = _load_manifest()
+    manifest = {}
     found_models = {}
     for module_info in iter_modules(models.__path__):
         if not module_info.ispkg:
             continue
 
-        try:
-            module = import_module(f'{__package__}.{module_info.name}')
-        except:
-            warn(f'{module_info.name} consist errors:\n {format_exc()}', ImportWarning)
-            continue
+        mtime = _package_mtime(module_info)
+        package = cached.get(module_info.name)
+        if mtime is not None and package and package['mtime'] == mtime:
+            module_models = package['models']
+        else:
+            try:
+                module = import_module(f'{__package__}.{module_info.name}')
+            except:
+                warn(f'{module_info.name} consist errors:\n {format_exc()}', ImportWarning)
+                continue
 
-        try:
-            module_models = dir(module)
-        except:
-            warn(f'{module_info.name}.ModelLoader consist errors:\n {format_exc()}', ImportWarning)
-            continue
+            try:
+                module_models = dir(module)
+            except:
+                warn(f'{module_info.name}.ModelLoader consist errors:\n {format_exc()}', ImportWarning)
+                continue
+
+        if mtime is not None:
+            manifest[module_info.name] = {'mtime': mtime, 'models': module_models}
 
         for model_name in module_models:
             if model_name in found_models:
-                warn(f"{module_info.name} has conflict model name '{model_name}' with {models[model_name]}",
+                warn(f"{module_info.name} has conflict model name '{model_name}' with {found_models[model_name]}",
                      ImportWarning)
             else:
-                found_models[model_name] = module
+                found_models[model_name] = module_info.name
+
+    if manifest != cached:
+        _save_manifest(manifest)
     return found_models
 
 
+_manifest = Path(getenv('CIMM_MODELS_MANIFEST') or Path.home() / '.cache' / 'CIMM' / 'models.json')
 _found_models = _scan_models()
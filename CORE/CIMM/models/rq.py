@@ -18,9 +18,16 @@
 #
 from CGRtools.containers import ReactionContainer, CGRContainer, MoleculeContainer
 from CGRtools.files import RDFread, MRVread, SDFread, SMILESread
+from collections import OrderedDict
+from hashlib import sha1
 from io import StringIO, BytesIO
+from itertools import repeat
+from multiprocessing import get_context
+from pickle import dumps, loads
 from re import split
+from redis import Redis, RedisError
 from requests import get
+from rq import get_current_job
 from shutil import rmtree
 from tempfile import mkdtemp
 from traceback import format_exc
@@ -30,6 +37,117 @@ from ..additives import Additive
 from ..constants import ModelType, ResultType, StructureStatus, StructureType
 
 
+class ModelsCache:
+    """
+    LRU cache of loaded models.
+
+    only models with set_work_path method can be reused. workpath of cached model replaced by given on each request.
+    """
+    def __init__(self, size=16):
+        self.__size = size
+        self.__models = OrderedDict()
+
+    def __call__(self, name, workpath):
+        try:
+            mod = self.__models.pop(name)
+        except KeyError:
+            mod = getattr(loader, name)(workpath)
+            if not hasattr(mod, 'set_work_path'):
+                return mod
+            if len(self.__models) >= self.__size:
+                self.__models.popitem(last=False)
+        else:
+            mod.set_work_path(workpath)
+        self.__models[name] = mod
+        return mod
+
+    def discard(self, name):
+        self.__models.pop(name, None)
+
+
+def load_model(name, workpath):
+    """
+    get model from cache if available or load new
+    """
+    if models_cache is None:
+        return getattr(loader, name)(workpath)
+    return models_cache(name, workpath)
+
+
+class ResultsCache:
+    """
+    redis cache of modeling results.
+
+    key is model name + model version + structure signature + conditions.
+    only models with version property are cached.
+    """
+    def __init__(self, redis, model, version, ttl):
+        self.__redis = redis
+        self.__prefix = f'cimm:results:{model}:{version}:'
+        self.__ttl = ttl
+
+    def get(self, structures):
+        """
+        set cached results to structures.
+
+        :return: list of structures not found in cache
+        """
+        self.__keys = keys = [self.__prefix + self.__hash(s) for s in structures]
+        try:
+            self.__cached = cached = self.__redis.mget(keys)
+        except RedisError:
+            warn(f'Results cache not available:\n{format_exc()}')
+            self.__cached = cached = [None] * len(keys)
+
+        misses = []
+        for s, c in zip(structures, cached):
+            if c is None:
+                misses.append(s)
+            else:
+                s['results'] = loads(c)
+        return misses
+
+    def update(self, structures, results):
+        """
+        store results of cache misses.
+
+        :return: list of all structures with results in original order
+        """
+        results = iter(results)
+        out = [next(results) if c is None else s for s, c in zip(structures, self.__cached)]
+        try:
+            with self.__redis.pipeline(transaction=False) as pipe:
+                for k, s, c in zip(self.__keys, out, self.__cached):
+                    if c is None:
+                        pipe.set(k, dumps(s['results']), ex=self.__ttl)
+                pipe.execute()
+        except RedisError:
+            warn(f'Results cache not available:\n{format_exc()}')
+        return out
+
+    @staticmethod
+    def __hash(structure):
+        key = (signature(structure['data']), structure['temperature'], structure['pressure'],
+               tuple((a.name, a.amount) for a in structure['additives']))
+        return sha1(repr(key).encode()).hexdigest()
+
+
+def signature(data):
+    return data.get_signature_hash(isotope=True, stereo=True)
+
+
+def fingerprint(structure, full=True):
+    """
+    cheap hash of structure meta. data, status, type and conditions included if full
+    """
+    meta = (structure.get('structure'), tuple((a.name, a.amount) for a in structure.get('additives') or ()),
+            tuple(tuple(sorted(d.items())) for d in structure.get('description') or ()))
+    if full:
+        meta += (signature(structure['data']), structure.get('status'), structure.get('type'),
+                 structure.get('temperature'), structure.get('pressure'))
+    return hash(meta)
+
+
 def run(structures, model):
     """
     model runner
@@ -42,42 +160,95 @@ def run(structures, model):
 
     if model not found or crashed return data without results in models[0]
     if model return list of results with size not equal to structures list size - raise exception. this model BAD! 
+
+    if worker has pool of processes, structures splitted to batches which processed in parallel.
     """
+    global models_cache
+    job = get_current_job()
+    if pool_size > 1 and len(structures) > batch_size:
+        if models_cache is None:  # job runs in disposable work horse
+            models_cache = ModelsCache(1)
+        workpath = mkdtemp()
+        try:
+            load_model(model, workpath)  # forked processes share loaded models of worker
+        except:  # failure reported by runner
+            return _run(structures, model, job and job.connection)
+        finally:
+            rmtree(workpath)
+
+        redis = job and job.connection.connection_pool.connection_kwargs
+        batches = [structures[x: x + batch_size] for x in range(0, len(structures), batch_size)]
+        # pool terminated on exit. pending batches dropped on job timeout
+        with get_context('fork').Pool(pool_size) as pool:
+            return [s for b in pool.starmap(_run_batch, zip(batches, repeat(model), repeat(redis))) for s in b]
+    return _run(structures, model, job and job.connection)
+
+
+def _run_batch(structures, model, redis):
+    return _run(structures, model, redis and Redis(**redis))
+
+
+def _run(structures, model, redis):
     def fail_prep(reason):
+        for s, b in zip(modeling, backup):  # model can edit structures inplace
+            for k, v in zip(fingerprinted, b):
+                if v is _missing:
+                    s.pop(k, None)
+                elif s.get(k) is not v:
+                    s[k] = v
         for s in structures:
             s['results'] = [dict(result='Modeling Failed', data=reason, type=ResultType.TEXT)]
         rmtree(workpath)
         return structures
 
+    modeling = backup = ()
     workpath = mkdtemp()
     try:
-        mod = getattr(loader, model)(workpath)
+        mod = load_model(model, workpath)
     except:
         warn(f'Model not found or not loadable.\n{format_exc()}', ImportWarning)
         return fail_prep('Model not found or not loadable')
 
+    modeling, cache = structures, None
+    if results_cache_ttl and redis and getattr(mod, 'version', None) and \
+            mod.type in (ModelType.REACTION_MODELING, ModelType.MOLECULE_MODELING):
+        cache = ResultsCache(redis, model, mod.version, results_cache_ttl)
+        modeling = cache.get(structures)
+        if not modeling:  # all results found in cache
+            rmtree(workpath)
+            return structures
+
+    full = mod.type in (ModelType.REACTION_MODELING, ModelType.MOLECULE_MODELING)
+    if full or mod.type == ModelType.PREPARER:
+        fingerprints = [fingerprint(x, full) for x in modeling]
+    backup = [tuple(x.get(k, _missing) for k in fingerprinted) for x in modeling]  # references only
+
     try:
-        results = mod([x.copy() for x in structures])
+        results = mod(modeling)
     except:
         warn(f'Model not working:\n{format_exc()}')
+        if models_cache is not None:  # model state can be broken
+            models_cache.discard(model)
         return fail_prep('Model not working')
 
     if not results:
         return fail_prep('Model returned nothing')
 
-    if len(results) != len(structures) and mod.type not in (ModelType.MOLECULE_SEARCHING,
-                                                            ModelType.REACTION_SEARCHING):
+    if len(results) != len(modeling) and mod.type not in (ModelType.MOLECULE_SEARCHING,
+                                                          ModelType.REACTION_SEARCHING):
         warn('Model lost structures. check model code for correctness')
         return fail_prep('Model lost data')
 
-    if mod.type in (ModelType.REACTION_MODELING, ModelType.MOLECULE_MODELING):
-        if any(s[x] != r[x] for s, r in zip(structures, results)
-               for x in ('data', 'structure', 'status', 'type', 'temperature', 'pressure', 'additives', 'description')):
+    if full:
+        if any(f != fingerprint(r) for f, r in zip(fingerprints, results)):
             warn('Editing structure, properties and meta denied! ONLY results assign possible!')
             return fail_prep('Model broke data')
 
+        if cache is not None:
+            results = cache.update(structures, results)
+
     if mod.type == ModelType.PREPARER:
-        if any(s[x] != r[x] for s, r in zip(structures, results) for x in ('structure', 'additives', 'description')):
+        if any(f != fingerprint(r, False) for f, r in zip(fingerprints, results)):
             warn('Editing meta denied! '
                  'ONLY results assigning, data, temperature, pressure type and status editing possible!')
             return fail_prep('Preparing model not working')
@@ -87,6 +258,10 @@ def run(structures, model):
     return results
 
 
+fingerprinted = ('structure', 'additives', 'description', 'data', 'status', 'type', 'temperature', 'pressure')
+_missing = object()
+
+
 def convert(structures, model):
     """
     $DTYPE additive.amount.1
@@ -185,9 +360,15 @@ def convert(structures, model):
         except ValueError:
             temperature = 298
 
-        out.append(dict(structure=n, data=s, status=StructureStatus.RAW, type=_type, additives=found_add,
-                        pressure=pressure, temperature=temperature))
+        out.append(dict(structure=n, data=s, status=StructureStatus.RAW, type=_type,
+                        additives=list(found_add.values()), pressure=pressure, temperature=temperature))
 
     if not out:
         raise Exception('File converter failed')
     return run(out, model)
+
+
+models_cache = None  # set by worker
+results_cache_ttl = 0  # set by worker
+pool_size = 0  # set by worker
+batch_size = 100  # set by worker
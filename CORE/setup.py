@@ -25,7 +25,7 @@ setup(
     name='CIMM-CORE',
     version=version(),
     packages=['CIMM', 'CIMM.CLI', 'CIMM.models'],
-    install_requires=['CGRtools>=2.8.32,<2.9'],
+    install_requires=['CGRtools>=2.8.32,<2.9', 'rq>=1.10,<2', 'redis>=4.2,<5'],
     extras_require={'autocomplete': ['argcomplete'], 'sphinx': ['sphinx>=1.6']},
     entry_points={'console_scripts': ['cimm=CIMM.CLI.loader:run']},
     package_data={'CIMM': ['additives.json']},
@@ -87,6 +87,9 @@ class ModelLoader:
                                     report.append(dict(result=k, data=v, type=ResultType.TEXT))
         return res
 
+    def set_work_path(self, workpath):
+        self.__workpath = workpath
+
     @classmethod
     def _get_models(cls):
         return list(cls.__names)
@@ -18,9 +18,11 @@
 #
 from CIMtools.preprocessing.common import iter2array
 from functools import partial
+from hashlib import md5
+from io import BytesIO
 from json import loads
 from pickle import load
-from pkg_resources import resource_string, resource_stream
+from pkg_resources import resource_string
 from sklearn.pipeline import FeatureUnion, Pipeline
 from ...constants import ModelType, ResultType
 
@@ -38,7 +40,9 @@ def set_work_path(steps, workpath):
 class ModelLoader:
     def __init__(self, name, workpath='.'):
         self.__object = self.__models[name]
-        self.__model = load(resource_stream(__package__, name))
+        dump = resource_string(__package__, name)
+        self.__model = load(BytesIO(dump))
+        self.__version = md5(dump).hexdigest()
         self.__workpath = workpath
         set_work_path(self.__model.steps, workpath)
 
@@ -53,6 +57,10 @@ class ModelLoader:
 
         return structures
 
+    def set_work_path(self, workpath):
+        self.__workpath = workpath
+        set_work_path(self.__model.steps, workpath)
+
     @classmethod
     def _get_models(cls):
         return list(cls.__models)
@@ -77,6 +85,10 @@ class ModelLoader:
     def example(self):
         return self.__object['example']
 
+    @property
+    def version(self):
+        return self.__version
+
     __models = {x['object']: x for x in loads(resource_string(__package__, 'models.json').decode())}
 
 
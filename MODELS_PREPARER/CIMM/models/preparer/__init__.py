@@ -180,6 +180,12 @@ class ModelLoader:
                                    type=ResultType.TEXT))
         return report, error
 
+    def set_work_path(self, workpath):
+        self.__workpath = workpath
+        for step in (self.__std_step_1, self.__std_step_2):
+            if hasattr(step, 'set_work_path'):
+                step.set_work_path(workpath)
+
     @staticmethod
     def _get_models():
         return ['Preparer']
@@ -17,18 +17,24 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from argparse import ArgumentDefaultsHelpFormatter, FileType
+from asyncio import (ensure_future, gather, get_running_loop, run as run_loop, sleep as async_sleep, wait_for,
+                     Queue as AsyncQueue, QueueFull, Semaphore, TimeoutError as AsyncTimeoutError)
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from pickle import loads, dumps
+from functools import partial
 from pony.orm import db_session
-from redis import Redis, ConnectionError
-from requests import post
+from redis import Redis, ConnectionError, RedisError, ResponseError
+from redis.asyncio import Redis as AsyncRedis
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+from socket import gethostname
 from rq import Queue
-from time import sleep
-from traceback import format_exc
+from traceback import format_exc, format_exception
 from warnings import warn
 from ..REST.jobs import database
-from ..REST.jobs.utils import update_chunks
+from ..REST.jobs.codec import set_codec, set_compression
+from ..REST.jobs.storage import TaskStorage
 
 
 def cmd(subparsers):
@@ -50,6 +56,14 @@ def cmd(subparsers):
     parser.add_argument('--chunk_size', '-s', type=int, default=50)
     parser.add_argument('--task_ttl', '-t', type=int, default=86400)
     parser.add_argument('--publish_url', '-pu', help='nchan publish url')
+    parser.add_argument('--consumer', '-cn', default=gethostname(),
+                        help='unique name of monitor instance. not acknowledged jobs of consumer replayed on start')
+    parser.add_argument('--workers', '-w', type=int, default=4, help='amount of results merging threads')
+    parser.add_argument('--layout', '-l', default='blob', help='storage layout of new tasks: blob or hash')
+    parser.add_argument('--codec', '-cd', default='pickle', help='tasks serialization format')
+    parser.add_argument('--compression', '-cm', help='compression of big chunks: zlib, lz4 or zstd')
+    parser.add_argument('--compression_threshold', '-ct', type=int, default=4096,
+                        help='minimal size of compressed chunks in bytes')
 
     parser.set_defaults(func=run)
 
@@ -69,6 +83,12 @@ def run(args):
         chunk_size = args.chunk_size
         task_ttl = args.task_ttl
         publish_url = args.publish_url
+        consumer = args.consumer
+        workers = args.workers
+        layout = args.layout
+        codec = args.codec
+        compression = args.compression
+        compression_threshold = args.compression_threshold
     else:
         config = ConfigParser()
         config.read_file(args.config)
@@ -86,63 +106,241 @@ def run(args):
             chunk_size = config[args.name].get('chunk_size', 50)
             task_ttl = config[args.name].get('task_ttl', 86400)
             publish_url = config[args.name]['publish_url']
+            consumer = config[args.name].get('consumer', gethostname())
+            workers = config[args.name].getint('workers', 4)
+            layout = config[args.name].get('layout', 'blob')
+            codec = config[args.name].get('codec', 'pickle')
+            compression = config[args.name].get('compression', None)
+            compression_threshold = config[args.name].getint('compression_threshold', 4096)
         except KeyError:
             raise KeyError('monitor config not found')
 
+    set_codec(codec)
+    set_compression(compression, compression_threshold)
     redis = Redis(host=redis_host, port=redis_port, password=redis_pass)
+    storage = TaskStorage(redis, layout, int(chunk_size), int(task_ttl))
 
     db = getattr(database, args.name)
     db.bind('postgres', user=postgres_user, password=postgres_pass, host=postgres_host, database=postgres_base,
             port=postgres_port)
     db.generate_mapping(create_tables=False)
+
+    run_loop(monitor(db, storage, publish_url, workers, consumer))
+
+
+async def monitor(db, storage, publish_url, workers, consumer):
+    """
+    read done jobs streams of all hosts concurrently. results merged in pool of threads.
+
+    destinations reloaded periodically. streams of new hosts are read without restart. queues of hosts
+    are created from stream entries.
+    """
+    loop = get_running_loop()
+    publisher = Publisher(publish_url)
+    with ThreadPoolExecutor(workers) as executor:
+        semaphore = Semaphore(workers * 2)  # limit of entries waiting for merge
+        publishing, listeners = ensure_future(publisher.run()), {}
+        while True:
+            if publishing.done():  # crashed publisher
+                publishing.result()
+            for hpp, x in listeners.items():
+                if x.done():  # crashed listener of host restarted. other hosts not affected
+                    e = x.exception()
+                    tb = ''.join(format_exception(type(e), e, e.__traceback__))
+                    warn(f'listener of {hpp[0]}:{hpp[1]} crashed:\n{tb}')
+                    listeners[hpp] = ensure_future(listen(hpp, storage, publisher, executor, semaphore, consumer))
+
+            try:
+                dests = await loop.run_in_executor(executor, destinations, db)
+            except Exception:
+                warn(f'destinations loading failed:\n{format_exc()}')
+            else:
+                for hpp in dests.difference(listeners):
+                    listeners[hpp] = ensure_future(listen(hpp, storage, publisher, executor, semaphore, consumer))
+            try:
+                await loop.run_in_executor(executor, storage.heartbeat, discovery_interval * 3)
+            except ConnectionError:
+                warn(f'redis connection error:\n{format_exc()}')
+            await async_sleep(discovery_interval)
+
+
+def destinations(db):
     with db_session:
-        dests = list(db.Destination.select())
+        return {(x.host, x.port, x.password) for x in db.Destination.select()}
+
+
+class Publisher:
+    """
+    nchan notifications sender.
+
+    notifications collected in window are deduplicated and grouped by users. messages with one task id are sent
+    to users concurrently by pool of http connections. messages of each user are sent in order.
+    failed requests are retried with exponential backoff. notifications are dropped if queue is full.
+    """
+    def __init__(self, url, size=10000, window=.2, connections=8, retries=3, backoff=.5, timeout=5):
+        self.__url = url
+        self.__queue = AsyncQueue(size)
+        self.__window = window
+        self.__connections = connections
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__timeout = timeout
+        self.__session = session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def notify(self, user, task):
+        try:
+            self.__queue.put_nowait((user, task))
+        except QueueFull:
+            warn(f"notifications queue is full. task '{task}' not published")
+
+    async def run(self):
+        loop = get_running_loop()
+        with ThreadPoolExecutor(self.__connections) as executor:
+            while True:
+                batch = defaultdict(dict)  # user: ordered set of tasks
+                user, task = await self.__queue.get()
+                batch[user][task] = None
+                deadline = loop.time() + self.__window
+                while True:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        user, task = await wait_for(self.__queue.get(), timeout)
+                    except AsyncTimeoutError:
+                        break
+                    batch[user][task] = None
+                await gather(*(self.__send_batch(loop, executor, user, tasks) for user, tasks in batch.items()))
+
+    async def __send_batch(self, loop, executor, user, tasks):
+        for task in tasks:  # one task id per message. messages of user sent in order
+            await self.__send(loop, executor, user, task)
+
+    async def __send(self, loop, executor, user, task):
+        for attempt in range(self.__retries + 1):
+            try:
+                r = await loop.run_in_executor(executor, partial(self.__session.post, self.__url + str(user),
+                                                                 data=task, timeout=self.__timeout))
+                r.raise_for_status()
+                return
+            except RequestException:
+                if attempt == self.__retries:
+                    warn(f"task '{task}' not published:\n{format_exc()}")
+                else:
+                    await async_sleep(self.__backoff * 2 ** attempt)
 
-    connections, channels = {}, {}
-    for hpp in set((x.host, x.port, x.password) for x in dests):
-        r = Redis(host=hpp[0], port=hpp[1], password=hpp[2])
-        p = r.pubsub()
-        p.subscribe('done_jobs')
-        connections[hpp] = r
-        channels[hpp] = p
 
-    queues = defaultdict(dict)
-    for x in dests:
-        hpp = (x.host, x.port, x.password)
-        queues[hpp][x.name] = Queue(connection=connections[hpp], name=x.name)
+async def listen(hpp, storage, publisher, executor, semaphore, consumer):
+    """
+    read entries of done jobs stream in monitors group. pending entries of consumer replayed first.
 
+    pending entries are replayed periodically: failed merges are retried and entries of died consumers are claimed.
+    """
+    loop = get_running_loop()
+    connection, queues, inflight, claiming = Redis(host=hpp[0], port=hpp[1], password=hpp[2]), {}, set(), True
+    redis = AsyncRedis(host=hpp[0], port=hpp[1], password=hpp[2])
     while True:
-        for hpp, p in channels.items():
+        try:
             try:
-                message = p.get_message()
-                if not message or message['type'] != 'message':
-                    continue
+                await redis.xgroup_create(stream, group, id='0', mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
 
-                name, _id = loads(message['data'])
-                job = queues[hpp][name].fetch_job(_id)
-                if not job:
-                    warn(f"invalid job id '{_id}' for worker '{name}' on host '{hpp}'")
-                    continue
+            last, recovered = '0', loop.time()  # not acknowledged entries of previous run
+            while True:
+                if loop.time() - recovered > recovery_interval:
+                    if claiming:
+                        try:
+                            await claim(redis, consumer)
+                        except ResponseError as e:
+                            if 'unknown command' not in str(e).lower():
+                                raise
+                            warn(f'redis server {hpp[0]}:{hpp[1]} older than 6.2. entries of died monitors not claimed')
+                            claiming = False
+                    last, recovered = '0', loop.time()
 
-                task_id = job.meta['task']
-                task = redis.get(task_id)
-                if not task:
-                    warn(f"job has invalid task id '{task_id}'")
+                response = await redis.xreadgroup(group, consumer, {stream: last}, count=100, block=10000)
+                entries = response and response[0][1]
+                if not entries:
+                    last = '>'
                     continue
+                if last != '>':
+                    last = entries[-1][0]
 
-                task = loads(task)
-                task['jobs'] = [x for x in task['jobs'] if x[2] != _id]
-                if job.is_finished:
-                    update_chunks(task['chunks'], job, redis, chunk_size, task_ttl)
-                    if job.ended_at > task['date']:
-                        task['date'] = job.ended_at
+                for _id, entry in entries:
+                    if _id in inflight:  # replayed entry not merged yet
+                        continue
+                    inflight.add(_id)
+                    await semaphore.acquire()
+                    future = loop.run_in_executor(executor, merge, connection, queues, _id, entry, storage)
+                    future.add_done_callback(partial(merged, semaphore, publisher, inflight, _id))
+        except RedisError:  # group recreated after reconnect. e.g. stream removed by flush
+            warn(f'redis error:\n{format_exc()}')
+            await async_sleep(reconnect_delay)
 
-                job.delete()
-                redis.set(task_id, dumps(task), ex=task_ttl)
 
-                if not task['jobs']:
-                    post(publish_url + str(task['user']), data=task_id)
+async def claim(redis, consumer):
+    """
+    take over entries not acknowledged by other consumers for claim_idle seconds
+    """
+    start = '0-0'
+    while True:
+        response = await redis.xautoclaim(stream, group, consumer, int(claim_idle * 1000), start, count=100)
+        start = response[0]
+        if start in (b'0-0', '0-0'):
+            break
 
-            except ConnectionError:
-                warn(f'redis connection error:\n{format_exc()}')
-        sleep(2)
+
+def merged(semaphore, publisher, inflight, entry_id, future):
+    semaphore.release()
+    inflight.discard(entry_id)
+    task = future.result()
+    if task:
+        publisher.notify(*task)
+
+
+def merge(connection, queues, entry_id, entry, storage):
+    """
+    merge job results into task. stream entry acknowledged after merge or if job or task not found
+
+    :return: user and task id of completed task
+    """
+    try:
+        name, _id = entry[b'queue'].decode(), entry[b'job'].decode()
+        queue = queues.get(name) or queues.setdefault(name, Queue(connection=connection, name=name))
+
+        job = queue.fetch_job(_id)
+        if not job:  # job expired or merged before monitor restart
+            warn(f"invalid job id '{_id}' for worker '{name}' on host '{connection}'")
+            connection.xack(stream, group, entry_id)
+            return
+
+        task_id = job.meta['task']
+        task = storage.get(task_id)
+        if not task:
+            warn(f"job has invalid task id '{task_id}'")
+            connection.xack(stream, group, entry_id)
+            return
+
+        pending = storage.update(task, [job])
+        job.delete()
+        connection.xack(stream, group, entry_id)
+
+        if pending == []:  # last job of task merged. concurrent monitors publish only once
+            return task['user'], task_id
+    except ConnectionError:
+        warn(f'redis connection error:\n{format_exc()}')
+    except Exception:
+        warn(f'job merging failed:\n{format_exc()}')
+
+
+stream = 'cimm:done_jobs'
+group = 'monitor'
+reconnect_delay = 2
+recovery_interval = 30
+claim_idle = 60
+discovery_interval = 10
@@ -19,6 +19,7 @@
 from flask import Blueprint
 from flask_login import LoginManager, UserMixin
 from . import database
+from .codec import set_codec, set_compression
 from .resources import *
 from .resources.create import TaskTypeConverter
 from ..utils import Documentation
@@ -50,6 +51,12 @@ def setup_database(state):
         db.generate_mapping(create_tables=False)
 
 
+def setup_codec(state):
+    config = state.app.config
+    set_codec(config.get('JOBS_REDIS_CODEC', 'pickle'))
+    set_compression(config.get('JOBS_REDIS_COMPRESSION'), config.get('JOBS_REDIS_COMPRESSION_THRESHOLD', 4096))
+
+
 def setup_login(state):
     app = state.app
     if not hasattr(app, 'login_manager'):  # set login manager ad-hoc
@@ -67,20 +74,25 @@ def setup_documentation(state):
 
     Documentation.register(Process, endpoint='process', blueprint=bp)
     Documentation.register(ProcessMetadata, endpoint='process_meta', blueprint=bp)
+    Documentation.register(ProcessStream, endpoint='process_stream', blueprint=bp)
+    Documentation.register(ProcessExport, endpoint='process_export', blueprint=bp)
 
     Documentation.register(Saved, endpoint='save', blueprint=bp)
     Documentation.register(SavedMetadata, endpoint='save_meta', blueprint=bp)
+    Documentation.register(SavedExport, endpoint='save_export', blueprint=bp)
     Documentation.register(SavedList, endpoint='saves', blueprint=bp)
     Documentation.register(SavedCount, endpoint='saves_count', blueprint=bp)
 
     Documentation.register(AvailableModels, endpoint='models', blueprint=bp)
     Documentation.register(AvailableAdditives, endpoint='additives', blueprint=bp)
     Documentation.register(MagicNumbers, endpoint='magic', blueprint=bp)
+    Documentation.register(CodecStats, endpoint='codec_stats', blueprint=bp)
 
 
 blueprint = Blueprint('CIMM_JobsAPI', __name__)
 blueprint.record_once(setup_documentation)
 blueprint.record_once(setup_database)
+blueprint.record_once(setup_codec)
 blueprint.record_once(setup_login)
 blueprint.record_once(lambda state: state.app.url_map.converters.update(TaskType=TaskTypeConverter))
 
@@ -97,11 +109,16 @@ process_view = Process.as_view('process')
 blueprint.add_url_rule('/process/<string:task>', view_func=process_view)
 blueprint.add_url_rule('/process/<string:task>/pages/<int(min=1):page>', view_func=process_view, methods=['GET'])
 blueprint.add_url_rule('/process/<string:task>/meta', view_func=ProcessMetadata.as_view('process_meta'))
+blueprint.add_url_rule('/process/<string:task>/stream', view_func=ProcessStream.as_view('process_stream'))
+blueprint.add_url_rule('/process/<string:task>/export/<any(sdf, rdf, csv):_format>',
+                       view_func=ProcessExport.as_view('process_export'))
 
 saved_view = Saved.as_view('save')
 blueprint.add_url_rule('/saves/<string:task>', view_func=saved_view)
 blueprint.add_url_rule('/saves/<string:task>/pages/<int(min=1):page>', view_func=saved_view, methods=['GET'])
 blueprint.add_url_rule('/saves/<string:task>/meta', view_func=SavedMetadata.as_view('save_meta'))
+blueprint.add_url_rule('/saves/<string:task>/export/<any(sdf, rdf, csv):_format>',
+                       view_func=SavedExport.as_view('save_export'))
 
 saved_list_view = SavedList.as_view('saves')
 blueprint.add_url_rule('/saves/', view_func=saved_list_view)
@@ -111,6 +128,7 @@ blueprint.add_url_rule('/saves/pages/count', view_func=SavedCount.as_view('saves
 blueprint.add_url_rule('/models/', view_func=AvailableModels.as_view('models'))
 blueprint.add_url_rule('/additives/', view_func=AvailableAdditives.as_view('additives'))
 blueprint.add_url_rule('/magic', view_func=MagicNumbers.as_view('magic'))
+blueprint.add_url_rule('/stats/codec', view_func=CodecStats.as_view('codec_stats'))
 
 blueprint.add_url_rule('/subscribe', view_func=SubscribeAuth.as_view('subscribe_auth'))
 blueprint.add_url_rule('/subscribe/internal/<int:channel>',
@@ -121,6 +139,11 @@ _config_ = {'JOBS_DB_SCHEMA': 'postgres schema',
             'JOBS_REDIS_TIMEOUT': 'jobs run timeout',
             'JOBS_REDIS_TTL': 'jobs results save time',
             'JOBS_REDIS_CHUNK': 'amount of structures per page',
+            'JOBS_REDIS_SPLIT': 'minimal amount of structures per job for splitting of big tasks. 0 - disable',
             'JOBS_REDIS_CONFIG': 'redis connection config',
+            'JOBS_REDIS_LAYOUT': 'storage layout of new tasks: blob or hash',
+            'JOBS_REDIS_CODEC': 'tasks serialization format: pickle or msgpack',
+            'JOBS_REDIS_COMPRESSION': 'compression of big chunks: zlib, lz4 or zstd. None - disabled',
+            'JOBS_REDIS_COMPRESSION_THRESHOLD': 'minimal size of compressed chunks in bytes',
             'JOBS_UPLOAD': 'path for upload of batch files',
             'JOBS_DB_CONFIG': 'dict of postgres connection config'}
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2018 Ramil Nugmanov <stsouko@live.ru>
+#  This file is part of CIMM (ChemoInformatics Models Manager).
+#
+#  CIMM is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+serialization of tasks and chunks stored in redis.
+
+first byte of blob is codec id in low 4 bits and compression id in high 4 bits.
+blobs started with pickle protocol opcode (0x80) are legacy pickles.
+"""
+from CGRtools.containers import MoleculeContainer, ReactionContainer
+from CGRtools.files import MRVread, MRVwrite
+from datetime import datetime
+from enum import Enum
+from importlib.util import find_spec
+from io import StringIO, BytesIO
+from pickle import dumps as pickle_dumps, loads as pickle_loads, HIGHEST_PROTOCOL
+from redis import RedisError
+from threading import Lock
+from time import monotonic, thread_time
+from zlib import compress as zlib_compress, decompress as zlib_decompress
+from ...additives import Additive
+from ...constants import (StructureStatus, StructureType, TaskStatus, ModelType, TaskType, AdditiveType,
+                          ResultType)
+
+
+class PickleCodec:
+    id = 1
+
+    @staticmethod
+    def dumps(obj):
+        return pickle_dumps(obj, HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        return pickle_loads(data)
+
+
+class MsgpackCodec:
+    """
+    msgpack with CIMM types extensions. structures stored as MRV strings independent from CGRtools version
+    """
+    id = 2
+
+    @classmethod
+    def dumps(cls, obj):
+        return packb(obj, default=cls.__default, use_bin_type=True)
+
+    @classmethod
+    def loads(cls, data):
+        return unpackb(data, ext_hook=cls.__ext_hook, raw=False, strict_map_key=False)
+
+    @classmethod
+    def __default(cls, obj):
+        if isinstance(obj, (MoleculeContainer, ReactionContainer)):
+            with StringIO() as f:
+                with MRVwrite(f) as w:
+                    w.write(obj)
+                return ExtType(3, f.getvalue().encode())
+        elif isinstance(obj, Additive):
+            return ExtType(4, packb((obj.id, obj.amount)))
+        elif isinstance(obj, datetime):
+            return ExtType(2, obj.isoformat().encode())
+        elif isinstance(obj, Enum) and type(obj).__name__ in cls.__enums:
+            return ExtType(1, packb((type(obj).__name__, obj.value)))
+        raise TypeError(f'unknown type: {type(obj)}')
+
+    @classmethod
+    def __ext_hook(cls, code, data):
+        if code == 3:
+            with BytesIO(data) as f, MRVread(f) as r:
+                return next(r)
+        elif code == 4:
+            _id, amount = unpackb(data)
+            return Additive(amount=amount, _id=_id)
+        elif code == 2:
+            return datetime.fromisoformat(data.decode())
+        elif code == 1:
+            name, value = unpackb(data, raw=False)
+            return cls.__enums[name](value)
+        return ExtType(code, data)
+
+    __enums = {x.__name__: x for x in (StructureStatus, StructureType, TaskStatus, ModelType, TaskType, AdditiveType,
+                                       ResultType)}
+
+
+class ZlibCompressor:
+    id = 1
+
+    @staticmethod
+    def compress(data):
+        return zlib_compress(data)
+
+    @staticmethod
+    def decompress(data):
+        return zlib_decompress(data)
+
+
+class LZ4Compressor:
+    id = 2
+
+    @staticmethod
+    def compress(data):
+        return lz4_compress(data)
+
+    @staticmethod
+    def decompress(data):
+        return lz4_decompress(data)
+
+
+class ZstdCompressor:
+    id = 3
+
+    @staticmethod
+    def compress(data):
+        return zstd_compressor().compress(data)  # zstd contexts are not thread safe
+
+    @staticmethod
+    def decompress(data):
+        return zstd_decompressor().decompress(data)
+
+
+def set_codec(name):
+    """
+    set codec used for serialization. stored blobs of all codecs are loadable
+    """
+    global _codec
+    try:
+        _codec = _available[name]
+    except KeyError:
+        raise ValueError(f"codec '{name}' not available")
+
+
+def set_compression(name=None, threshold=4096):
+    """
+    set compressor of blobs bigger than threshold bytes. None - disable compression
+    """
+    global _compressor, _threshold
+    if name is None:
+        _compressor = None
+    else:
+        try:
+            _compressor = _available_compressors[name]
+        except KeyError:
+            raise ValueError(f"compression '{name}' not available")
+    _threshold = threshold
+
+
+def stats(redis):
+    """
+    compression statistics of all API and monitor processes shared in redis: amount of compressed and decompressed
+    blobs, sizes of blobs before and after compression, ratio and spent cpu time in seconds
+    """
+    flush_stats(redis, force=True)
+    out = {k: type(v)() for k, v in _stats.items()}
+    for k, v in redis.hgetall(stats_key).items():
+        k = k.decode()
+        if k in out:
+            out[k] = type(out[k])(float(v))
+    out['ratio'] = out['raw_size'] / out['compressed_size'] if out['compressed_size'] else None
+    return out
+
+
+def flush_stats(redis, force=False):
+    """
+    add statistics collected by current process since last flush into shared stats hash.
+    without force flushed not often than once per stats_interval seconds
+    """
+    global _flushed
+    now = monotonic()
+    with _stats_lock:
+        if not force and now - _flushed < stats_interval:
+            return
+        _flushed = now
+        delta = {k: v for k, v in _stats.items() if v}
+        for k, v in delta.items():
+            _stats[k] -= v
+
+    if delta:
+        try:
+            with redis.pipeline(transaction=False) as pipe:
+                for k, v in delta.items():
+                    pipe.hincrbyfloat(stats_key, k, v)
+                pipe.execute()
+        except RedisError:  # keep statistics for next flush. statistics shouldn't break tasks storing
+            with _stats_lock:
+                for k, v in delta.items():
+                    _stats[k] += v
+
+
+def dumps(obj):
+    data = _codec.dumps(obj)
+    if _compressor is not None and len(data) >= _threshold:
+        start = thread_time()
+        compressed = _compressor.compress(data)
+        spent = thread_time() - start
+        with _stats_lock:  # counters shared by threads of monitor
+            _stats['compress_time'] += spent
+            _stats['compressed'] += 1
+            _stats['raw_size'] += len(data)
+            _stats['compressed_size'] += len(compressed)
+        if len(compressed) < len(data):
+            return bytes((_codec.id | _compressor.id << 4,)) + compressed
+    return bytes((_codec.id,)) + data
+
+
+def loads(blob):
+    tag = blob[0]
+    if tag == 0x80:  # legacy pickle
+        return pickle_loads(blob)
+
+    data = memoryview(blob)[1:]
+    if tag >> 4:
+        start = thread_time()
+        data = _compressors[tag >> 4].decompress(data)
+        spent = thread_time() - start
+        with _stats_lock:
+            _stats['decompress_time'] += spent
+            _stats['decompressed'] += 1
+    return _codecs[tag & 15].loads(data)
+
+
+_available = {'pickle': PickleCodec}
+if find_spec('msgpack'):
+    from msgpack import packb, unpackb, ExtType
+    _available['msgpack'] = MsgpackCodec
+
+_available_compressors = {'zlib': ZlibCompressor}
+if find_spec('lz4'):
+    from lz4.frame import compress as lz4_compress, decompress as lz4_decompress
+    _available_compressors['lz4'] = LZ4Compressor
+if find_spec('zstandard'):
+    from zstandard import ZstdCompressor as zstd_compressor, ZstdDecompressor as zstd_decompressor
+    _available_compressors['zstd'] = ZstdCompressor
+
+_codecs = {x.id: x for x in _available.values()}
+_compressors = {x.id: x for x in _available_compressors.values()}
+_codec = PickleCodec
+_compressor = None
+_threshold = 4096
+_stats = {'compressed': 0, 'decompressed': 0, 'raw_size': 0, 'compressed_size': 0, 'compress_time': 0.,
+          'decompress_time': 0.}
+_stats_lock = Lock()
+_flushed = 0.
+stats_key = 'cimm:codec:stats'
+stats_interval = 10
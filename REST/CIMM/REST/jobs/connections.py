@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2018 Ramil Nugmanov <stsouko@live.ru>
+#  This file is part of CIMM (ChemoInformatics Models Manager).
+#
+#  CIMM is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from collections import namedtuple
+from os import getpid
+from pickle import loads
+from redis import Redis, RedisError, ConnectionError
+from rq import Queue
+from threading import Lock, Thread
+from time import sleep, time
+from traceback import format_exc
+from warnings import warn
+
+
+def get_connection(host='localhost', port=6379, password=None, **kwargs):
+    """
+    get redis client with connection pool shared in process.
+
+    availability of redis servers checked by background probe.
+    :raise ConnectionError: redis server not available
+    """
+    key = (host, port, password or None, *sorted(kwargs.items()))
+    with _lock:
+        if _state['pid'] != getpid():  # connections and thread not inherited by forked process
+            _connections.clear()
+            _alive.clear()
+            _loads.clear()
+            _state['pid'] = getpid()
+            _state['probe'] = None
+
+        redis = _connections.get(key)
+        if redis is None:
+            redis = _connections[key] = Redis(host=host, port=port, password=password or None, **kwargs)
+            _alive[key] = _ping(redis)
+
+        if _state['probe'] is None or not _state['probe'].is_alive():  # restart of probe died on unexpected error
+            _state['probe'] = probe = Thread(target=_probe, args=(_state['pid'],), daemon=True)
+            probe.start()
+
+    if not _alive[key]:
+        raise ConnectionError(f'redis server {host}:{port} not available')
+    return redis
+
+
+class Load(namedtuple('Load', ['length', 'workers', 'busy', 'duration'])):
+    """
+    load of destination queue: queue length, alive workers count, busy workers count and mean job duration
+    """
+    @property
+    def eta(self):
+        """
+        expected time of completion of new job
+        """
+        if not self.workers:
+            return float('inf')
+        return (self.length + self.busy + 1) * (self.duration or 1) / self.workers
+
+
+def get_load(redis, name):
+    """
+    get cached load of queue. load refreshed by background probe.
+
+    :param redis: client returned by get_connection
+    :param name: queue name
+    """
+    key = (redis, name)
+    load = _loads.get(key)
+    if load is None:
+        try:
+            load = _loads[key] = _fetch_load(redis, name)
+        except ConnectionError:
+            disconnected(redis)
+            raise
+    return load
+
+
+def disconnected(redis):
+    """
+    mark redis server of client as not available until next successful probe
+    """
+    with _lock:
+        for key, r in _connections.items():
+            if r is redis:
+                _alive[key] = False
+
+
+def enqueued(redis, name):
+    """
+    update cached load of queue after enqueue of job
+    """
+    key = (redis, name)
+    load = _loads.get(key)
+    if load is not None:
+        _loads[key] = load._replace(length=load.length + 1)
+
+
+def _fetch_load(redis, name):
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.llen(Queue.redis_queue_namespace_prefix + name)
+        pipe.hgetall(f'cimm:load:{name}')
+        length, workers = pipe.execute()
+
+    now = time()
+    workers = [x for x in (loads(x) for x in workers.values()) if x[2] > now]  # (busy, duration, deadline)
+    durations = [x[1] for x in workers if x[1] is not None]
+    return Load(length, len(workers), sum(x[0] for x in workers),
+                sum(durations) / len(durations) if durations else None)
+
+
+def _ping(redis):
+    try:
+        return redis.ping()
+    except RedisError:
+        return False
+
+
+def _probe(pid):
+    while True:
+        sleep(probe_interval)
+        if _state['pid'] != pid:
+            break
+        with _lock:
+            connections = list(_connections.items())
+        for key, redis in connections:
+            _alive[key] = _ping(redis)
+
+        for key in list(_loads):
+            redis, name = key
+            try:
+                _loads[key] = _fetch_load(redis, name)
+            except RedisError:
+                _loads.pop(key, None)
+            except:  # broken load statistics of workers. probe should stay alive
+                warn(f'Queue load not loadable:\n{format_exc()}')
+                _loads.pop(key, None)
+
+
+probe_interval = 10
+_connections = {}
+_alive = {}
+_loads = {}
+_state = {'pid': None, 'probe': None}
+_lock = Lock()
@@ -17,9 +17,13 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from datetime import datetime
+from math import ceil
 from pony.orm import PrimaryKey, Required, Optional, Set, Json, Database
-from redis import Redis, ConnectionError
+from redis import ConnectionError, RedisError
 from rq import Queue
+from traceback import format_exc
+from warnings import warn
+from .connections import disconnected, enqueued, get_connection, get_load
 from ...constants import ModelType
 
 
@@ -54,22 +58,63 @@ def __getattr__(schema):
         def type(self):
             return ModelType(self._type)
 
-        def create_job(self, structures, task_id, runner, job_timeout=3600, result_ttl=86400):
+        def create_job(self, structures, task_id, runner, job_timeout=3600, result_ttl=86400, split=0):
+            """
+            enqueue structures to destinations with minimal expected time of completion.
+
+            if split set and structures list is bigger, it will be splitted to jobs with at least split structures
+            distributed over destinations. parts of failed destinations enqueued to other destinations.
+
+            :return: list of jobs ids
+            :raise ConnectionError: destinations not available. enqueued jobs of task removed
+            """
             qs = []
             for d in self.destinations:
                 try:
                     q = d.get_queue(job_timeout)
-                    qs.append((d, q))
-                except ConnectionError:
-                    pass
-            try:
-                d, q = min(qs, key=lambda x: len(x[1]))
-            except ValueError:
+                    load = get_load(q.connection, q.name)
+                except RedisError:
+                    continue
+                except:  # broken load statistics of workers
+                    warn(f'Queue load not loadable:\n{format_exc()}')
+                    continue
+                qs.append((load.eta, load.length, d, q))
+            if not qs:
                 raise ConnectionError
 
-            return self.id, d.id, q.enqueue_call(runner, kwargs={'structures': structures, 'model': self.object},
-                                                 result_ttl=result_ttl,
-                                                 meta={'task': task_id, 'model': self.id, 'destination': d.id}).id
+            qs.sort(key=lambda x: x[:2])
+            if split and isinstance(structures, list) and len(structures) > split:
+                n = min(len(qs), ceil(len(structures) / split))
+                size = ceil(len(structures) / n)
+                parts = [structures[x: x + size] for x in range(0, len(structures), size)]
+            else:
+                parts = [structures]
+
+            jobs, failed = [], set()
+            for n, p in enumerate(parts):
+                for *_, d, q in qs[n:] + qs[:n]:  # part of failed destination enqueued to next destinations
+                    if d.id in failed:
+                        continue
+                    try:
+                        job = q.enqueue_call(runner, kwargs={'structures': p, 'model': self.object},
+                                             result_ttl=result_ttl,
+                                             meta={'task': task_id, 'model': self.id, 'destination': d.id})
+                    except RedisError as e:
+                        if isinstance(e, ConnectionError):  # server died after last probe
+                            disconnected(q.connection)
+                        failed.add(d.id)
+                        continue
+                    enqueued(q.connection, q.name)
+                    jobs.append((d, job))
+                    break
+                else:  # all destinations failed. jobs of not saved task shouldn't run
+                    for _, job in jobs:
+                        try:
+                            job.delete()
+                        except RedisError:
+                            pass
+                    raise ConnectionError
+            return [(self.id, d.id, job.id) for d, job in jobs]
 
         @classmethod
         def fetch_job(cls, job_id):
@@ -82,7 +127,11 @@ def __getattr__(schema):
                 raise KeyError('invalid destination')
 
             queue = dest.get_queue()
-            job = queue.fetch_job(q_id)
+            try:
+                job = queue.fetch_job(q_id)
+            except ConnectionError:
+                disconnected(queue.connection)
+                raise
             if job is None:
                 raise KeyError('invalid job')
             return job
@@ -100,8 +149,7 @@ def __getattr__(schema):
             super().__init__(**{x: y for x, y in kwargs.items() if y})
 
         def get_queue(self, job_timeout=3600):
-            r = Redis(host=self.host, port=self.port, password=self.password)
-            r.ping()
+            r = get_connection(self.host, self.port, self.password)
             return Queue(connection=r, name=self.name, default_timeout=job_timeout)
 
     class Task(db.Entity):
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2018 Ramil Nugmanov <stsouko@live.ru>
+#  This file is part of CIMM (ChemoInformatics Models Manager).
+#
+#  CIMM is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+export of processed structures to files.
+
+structures conditions written to SDF/RDF data fields in format parsed by models runner: temperature, pressure and
+additive.amount.N fields. text results of models written as {model name}.{result key} fields.
+"""
+from CGRtools.containers import MoleculeContainer
+from CGRtools.files import MRVread, RDFwrite, SDFwrite
+from csv import writer
+from io import BytesIO, StringIO
+from ...constants import ResultType
+
+
+mimetypes = {'sdf': 'chemical/x-mdl-sdfile', 'rdf': 'chemical/x-mdl-rdfile', 'csv': 'text/csv'}
+
+
+def export(chunks, fmt):
+    """
+    generator of parts of file
+
+    :param chunks: iterable of lists of marshaled processed structures. data of structures can be MRV strings or
+                   containers
+    :param fmt: sdf, rdf or csv. only molecules written to sdf
+    """
+    with StringIO() as f:
+        if fmt == 'csv':
+            w = writer(f)
+            w.writerow(('structure', 'data', 'temperature', 'pressure', 'additives', 'model', 'key', 'value'))
+            for chunk in chunks:
+                for s in chunk:
+                    w.writerows(_rows(s))
+                yield _flush(f)
+        else:
+            with (SDFwrite if fmt == 'sdf' else RDFwrite)(f) as w:
+                for chunk in chunks:
+                    for s in chunk:
+                        data = _container(s['data'])
+                        if fmt == 'sdf' and not isinstance(data, MoleculeContainer):
+                            continue
+                        data.meta.clear()
+                        data.meta.update(_meta(s))
+                        w.write(data)
+                    yield _flush(f)
+            yield f.getvalue()
+
+
+def _flush(f):
+    out = f.getvalue()
+    f.seek(0)
+    f.truncate()
+    return out
+
+
+def _container(data):
+    if isinstance(data, str):
+        with BytesIO(data.encode()) as f, MRVread(f) as r:
+            return next(r)
+    return data
+
+
+def _meta(structure):
+    meta = {x['key']: x['value'] for x in structure.get('description', ())}
+    meta['temperature'] = structure['temperature']
+    meta['pressure'] = structure['pressure']
+    for n, a in enumerate(structure.get('additives', ()), start=1):
+        meta[f'additive.amount.{n}'] = f"{a['name']} = {a['amount']}"
+    for m in structure.get('models', ()):
+        for r in m['results']:
+            if r['type'] == ResultType.TEXT.value:
+                meta[f"{m['name']}.{r['key']}"] = r['value']
+    return meta
+
+
+def _rows(structure):
+    head = (structure['structure'], str(_container(structure['data'])), structure['temperature'],
+            structure['pressure'], '; '.join(f"{a['name']} = {a['amount']}" for a in structure.get('additives', ())))
+    results = [(m['name'], r['key'], r['value']) for m in structure.get('models', ()) for r in m['results']
+               if r['type'] == ResultType.TEXT.value]
+    if not results:
+        return [head + (None, None, None)]
+    return [head + r for r in results]
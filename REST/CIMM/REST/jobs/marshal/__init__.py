@@ -20,4 +20,5 @@ from .common import CountSchema
 from .documents import CreatingDocumentSchema, PreparingDocumentSchema, ProcessingDocumentSchema, AdditiveSchema
 from .model import DataBaseModelSchema, DeployModelSchema
 from .save import SavedMetadataSchema, ExtendedSavedMetadataSchema, SavedListSchema, SavedSchema
-from .task import MetadataSchema, ExtendedMetadataSchema, PreparedSchema, ProcessedSchema
+from .task import (MetadataSchema, ExtendedMetadataSchema, ExtendedProcessedMetadataSchema, PreparedSchema,
+                   ProcessedSchema)
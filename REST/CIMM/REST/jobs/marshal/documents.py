@@ -19,7 +19,7 @@
 from CGRtools.containers import ReactionContainer
 from flask import current_app
 from marshmallow import Schema, ValidationError, pre_dump, post_load, post_dump, EXCLUDE
-from marshmallow.fields import String, Integer, Float, Nested, Boolean, Method
+from marshmallow.fields import String, Integer, Float, Nested, Boolean, Method, List
 from marshmallow.validate import Range
 from pony.orm import ObjectNotFound
 from pony.orm.core import Entity
@@ -151,3 +151,4 @@ class PreparingDocumentSchema(DocumentSchema):
 class ProcessingDocumentSchema(DocumentSchema):
     data = StructureField(dump_only=True, description='string containing MRV structure')
     models = Nested(ModelSchema, many=True, required=True)
+    pending = List(Integer(), dump_only=True, description='ids of models which results of structure not ready yet')
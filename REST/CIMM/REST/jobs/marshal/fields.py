@@ -23,16 +23,28 @@ from io import StringIO, BytesIO
 from marshmallow.fields import String, Integer
 
 
+def mrv(structure):
+    """
+    serialize container to MRV string
+    """
+    with StringIO() as f:
+        with MRVwrite(f) as w:
+            w.write(structure)
+        return f.getvalue()
+
+
 class StructureField(String):
+    """
+    CGRtools container. strings are dumped as is, structures can be serialized to MRV before dumping
+    """
     def _serialize(self, value, attr, obj):
+        if isinstance(value, str):
+            return value
         if isinstance(value, (MoleculeContainer, ReactionContainer)):
-            with StringIO() as f:
-                with MRVwrite(f) as w:
-                    try:
-                        w.write(value)
-                    except (ValueError, KeyError):
-                        self.fail('not_container')
-                return f.getvalue()
+            try:
+                return mrv(value)
+            except (ValueError, KeyError):
+                self.fail('not_container')
         self.fail('not_container')
 
     def _deserialize(self, value, attr, data):
@@ -32,13 +32,24 @@ class MetadataSchema(Schema):
     user = Integer(description='task owner id')
 
 
+class ProgressSchema(Schema):
+    model = Integer(description='id of model')
+    jobs = Integer(description='amount of jobs of model')
+    pending = Integer(description='amount of not finished jobs of model')
+
+
 class PreparedSchema(MetadataSchema):
     structures = Nested(PreparingDocumentSchema, many=True, default=list)
 
 
 class ProcessedSchema(MetadataSchema):
     structures = Nested(ProcessingDocumentSchema, many=True, default=list)
+    progress = Nested(ProgressSchema, many=True, default=list, description='completion of models jobs')
 
 
 class ExtendedMetadataSchema(MetadataSchema):
     structures = Nested(CountSchema, description='amount of available data')
+
+
+class ExtendedProcessedMetadataSchema(ExtendedMetadataSchema):
+    progress = Nested(ProgressSchema, many=True, default=list, description='completion of models jobs')
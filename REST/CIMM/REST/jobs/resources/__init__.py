@@ -21,6 +21,7 @@ from .create import CreateTask, UploadTask, BatchDownload
 from .event import SubscribeAuth, PubSubURL
 from .magic import MagicNumbers
 from .model import AvailableModels
-from .process import Process, ProcessMetadata
+from .process import Process, ProcessMetadata, ProcessStream, ProcessExport
 from .prepare import Prepare, PrepareMetadata
-from .save import Saved, SavedMetadata, SavedList, SavedCount
+from .save import Saved, SavedMetadata, SavedExport, SavedList, SavedCount
+from .stats import CodecStats
@@ -16,16 +16,19 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 from flask import current_app
 from flask_apispec import MethodResource, marshal_with
 from flask_login import current_user, login_required
-from pickle import dumps, loads
 from pony.orm import db_session
-from redis import Redis, ConnectionError
+from redis import ConnectionError
 from uuid import uuid4
 from .. import database
-from ..utils import update_chunks
+from ..marshal.fields import mrv
+from ..connections import get_connection
+from ..storage import TaskStorage
+from ..utils import chunks_fills
 from ...utils import abort
 from ....constants import TaskStatus
 
@@ -39,42 +42,45 @@ class JobMixin(MethodResource):
         if task_id is None:
             task_id = str(uuid4())
 
-        job_id = model.create_job(data, task_id, 'CIMM.models.rq.' + runner,
-                                  current_app.config.get('JOBS_REDIS_TIMEOUT', 3600),
-                                  current_app.config.get('JOBS_REDIS_TTL', 86400))
-        return job_id, task_id
-
-    def save(self, task_id, _type, status, jobs, data=None):
-        chunks = current_app.config.get('JOBS_REDIS_CHUNK', 50)
-        ex = current_app.config.get('JOBS_REDIS_TTL', 86400)
-        tmp = {}
-        if data:
-            for x in range(0, len(data), chunks):  # store structures in chunks.
-                _id = str(uuid4())
-                chunk = {s['structure']: s for s in data[x: x + chunks]}
-                self.redis.set(_id, dumps(chunk), ex=ex)
-                for s in chunk:
-                    tmp[s] = _id
-
-        self.redis.set(task_id, dumps({'chunks': tmp, 'jobs': jobs, 'user': current_user.id,
-                                       'type': _type, 'task': task_id, 'date': datetime.utcnow(),
-                                       'status': TaskStatus.PREPARED if status == TaskStatus.PREPARING else
-                                                 TaskStatus.PROCESSED}), ex=ex)
+        jobs = model.create_job(data, task_id, 'CIMM.models.rq.' + runner,
+                                current_app.config.get('JOBS_REDIS_TIMEOUT', 3600),
+                                current_app.config.get('JOBS_REDIS_TTL', 86400),
+                                current_app.config.get('JOBS_REDIS_SPLIT', 0))
+        return jobs, task_id
+
+    def save(self, task_id, _type, status, jobs, data=None, requested=None):
+        """
+        store task
+
+        :param requested: dict of structure id: list of models ids applied to structure
+        """
+        task = {'jobs': jobs, 'models': dict(Counter(x[0] for x in jobs)), 'user': current_user.id, 'type': _type,
+                'task': task_id, 'date': datetime.utcnow(),
+                'status': TaskStatus.PREPARED if status == TaskStatus.PREPARING else TaskStatus.PROCESSED}
+        if requested:
+            task['requested'] = requested
+        self.storage.save(task_id, task, data)
 
         return {'task': task_id, 'status': status, 'type': _type, 'date': datetime.utcnow(), 'user': current_user.id}
 
     @property
     def redis(self):
         if self.__redis_cache is None:
-            redis = Redis(**current_app.config.get('JOBS_REDIS_CONFIG', {}))
             try:
-                redis.ping()
+                self.__redis_cache = get_connection(**current_app.config.get('JOBS_REDIS_CONFIG', {}))
             except ConnectionError:
                 abort(500, 'dispatcher server error')
-            self.__redis_cache = redis
 
         return self.__redis_cache
 
+    @property
+    def storage(self):
+        if self.__storage_cache is None:
+            self.__storage_cache = TaskStorage(self.redis, current_app.config.get('JOBS_REDIS_LAYOUT', 'blob'),
+                                               current_app.config.get('JOBS_REDIS_CHUNK', 50),
+                                               current_app.config.get('JOBS_REDIS_TTL', 86400))
+        return self.__storage_cache
+
     @property
     def models(self):
         if self.__models_cache is None:
@@ -87,41 +93,92 @@ class JobMixin(MethodResource):
             self.__destinations_cache = getattr(database, current_app.config['JOBS_DB_SCHEMA']).Destination
         return self.__destinations_cache
 
-    def fetch_meta(self, task, status):
-        result = self.__fetch(task, status)
-        chunks = result['chunks']
-        return {'structures': {'total': len(chunks), 'pages': len(set(chunks.values())) or 1,
-                               'size': current_app.config.get('JOBS_REDIS_CHUNK', 50)}, **result}
+    def fetch_meta(self, task, status, partial=False):
+        result = self.__fetch(task, status, partial)
+        size = current_app.config.get('JOBS_REDIS_CHUNK', 50)
+        fills, _ = chunks_fills(result, size)
+        return {'structures': {'total': len(result['chunks']), 'pages': len(fills) or 1, 'size': size},
+                'progress': self.__progress(result), **result}
 
-    def fetch(self, task, status, page=None):
-        result = self.__fetch(task, status)
+    def fetch(self, task, status, page=None, partial=False, serialize=False):
+        """
+        get task with structures
+
+        :param partial: return results of finished jobs if task has pending jobs and results of any job merged
+        :param serialize: replace data of structures by MRV strings
+        """
+        result = self.__fetch(task, status, partial)
 
-        loaded_chunks = {}
         chunks = result['chunks']
+        fills, _ = chunks_fills(result, current_app.config.get('JOBS_REDIS_CHUNK', 50))
         if page is None:
-            tmp = []
-            for s_id in sorted(chunks):
-                ch_id = chunks[s_id]
-                ch = loaded_chunks.get(ch_id) or loaded_chunks.setdefault(ch_id, loads(self.redis.get(ch_id)))
-                tmp.append(ch[s_id])
+            ch_ids = list(fills)
+            loaded_chunks = dict(zip(ch_ids, self.storage.get_chunks(result, ch_ids)))
+            tmp = [loaded_chunks[chunks[s_id]][s_id] for s_id in sorted(chunks)]
         else:
-            chunks = sorted(set(chunks.values()))
+            chunks = sorted(fills)  # pages in order of chunks creation
             if page > len(chunks):
                 abort(404, 'page not found')
 
-            ch = loads(self.redis.get(chunks[page - 1]))
+            ch = self.storage.get_chunks(result, [chunks[page - 1]])[0]
             tmp = [ch[s_id] for s_id in sorted(ch)]
+            loaded_chunks = {chunks[page - 1]: ch}
+
+        if serialize:
+            self.__serialize(loaded_chunks)
+
+        if partial:
+            requested = result.get('requested', {})
+            pending = {x[0] for x in result['jobs']}
+            for s in tmp:
+                ready = {x['model'] for x in s['models']}
+                s['pending'] = [x for x in requested.get(s['structure'], ()) if x in pending and x not in ready]
+        return {'structures': tmp, 'progress': self.__progress(result), **result}
+
+    def fetch_chunks(self, task, status):
+        """
+        get task and iterator of lists of structures of pages. pages loaded from redis on iteration
+        """
+        result = self.__fetch(task, status)
+        fills, _ = chunks_fills(result, current_app.config.get('JOBS_REDIS_CHUNK', 50))
+
+        def chunks():
+            for c_id in sorted(fills):
+                ch = self.storage.get_chunks(result, [c_id])[0]
+                yield [ch[s_id] for s_id in sorted(ch)]
+
+        return result, chunks()
+
+    def __serialize(self, chunks):
+        """
+        replace data of structures by MRV strings. MRV strings cached in redis on first serialization
+        """
+        c_ids = list(chunks)
+        new = {}
+        for c_id, serialized in zip(c_ids, self.storage.get_serialized(c_ids)):
+            for s_id, s in chunks[c_id].items():
+                data = serialized.get(s_id)
+                if data is None:
+                    try:
+                        data = mrv(s['data'])
+                    except (ValueError, KeyError):
+                        continue  # invalid structures rejected by marshal
+                    new.setdefault(c_id, {})[s_id] = data
+                s['data'] = data
+        if new:
+            self.storage.set_serialized(new)
 
-        return {'structures': tmp, **result}
+    @staticmethod
+    def __progress(task):
+        pending = Counter(x[0] for x in task['jobs'])
+        return [{'model': m, 'jobs': n, 'pending': pending[m]} for m, n in (task.get('models') or pending).items()]
 
-    def __fetch(self, task_id, status):
-        task = self.redis.get(task_id)
+    def __fetch(self, task_id, status, partial=False):
+        task = self.storage.get(task_id)
 
         if task is None:
             abort(404, 'invalid task id. perhaps this task has already been removed')
 
-        task = loads(task)
-
         if task['status'] != status:
             abort(404, 'task with valid status not found')
 
@@ -129,25 +186,35 @@ class JobMixin(MethodResource):
             abort(403, 'user access deny')
 
         if task['jobs']:
-            jobs = [self.models.fetch_job(x) for x in task['jobs']]
-            if any(x.is_queued or x.is_started for x in jobs):
+            timeout = timedelta(seconds=current_app.config.get('JOBS_REDIS_TIMEOUT', 3600))
+            if datetime.utcnow() - task['date'] < timeout and self.storage.monitored():
+                if not partial or not task['chunks']:  # results of any job not merged yet
+                    abort(512, 'PROCESSING.Task not ready')
+                return task  # jobs list updated by monitor on jobs finishing
+
+            # monitor not available or jobs lost. inspect jobs
+            jobs, lost = [], []
+            for x in task['jobs']:
+                try:
+                    jobs.append(self.models.fetch_job(x))
+                except KeyError:  # job merged by monitor or expired
+                    lost.append(x[2])
+            done = [x for x in jobs if not (x.is_queued or x.is_started)]
+            if len(done) < len(jobs) and not partial:
                 abort(512, 'PROCESSING.Task not ready')
 
-            ended_at = task['date']
-            for job in jobs:
-                if job.is_finished:
-                    update_chunks(task['chunks'], job, self.redis, current_app.config.get('JOBS_REDIS_CHUNK', 50),
-                                  current_app.config.get('JOBS_REDIS_TTL', 86400))
-                    if job.ended_at > ended_at:
-                        ended_at = job.ended_at
-                job.delete()
-
-            task['jobs'] = []
-            task['date'] = ended_at
-            self.redis.set(task_id, dumps(task), ex=current_app.config.get('JOBS_REDIS_TTL', 86400))
+            if done or lost:
+                if self.storage.update(task, done, lost) is None:
+                    abort(404, 'invalid task id. perhaps this task has already been removed')
+                for job in done:
+                    job.delete()
+                task = self.storage.get(task_id)
+
+            if partial and task['jobs'] and not task['chunks']:  # results of any job not merged yet
+                abort(512, 'PROCESSING.Task not ready')
         return task
 
-    __redis_cache = __models_cache = __destinations_cache = None
+    __redis_cache = __storage_cache = __models_cache = __destinations_cache = None
 
 
 def dynamic_docstring(*sub):
@@ -59,11 +59,11 @@ class CreateTask(JobMixin):
             d['structure'] = n
 
         try:
-            job_id, task_id = self.enqueue(preparer, data)
+            jobs, task_id = self.enqueue(preparer, data)
         except ConnectionError:
             abort(500, 'modeling server error')
 
-        return self.save(task_id, _type, TaskStatus.PREPARING, [job_id]), 201
+        return self.save(task_id, _type, TaskStatus.PREPARING, jobs), 201
 
 
 class UploadTask(JobMixin):
@@ -127,11 +127,11 @@ class UploadTask(JobMixin):
             if file_url is None:
                 abort(400, 'structure file required')
         try:
-            job_id, task_id = self.enqueue(preparer, file_url, runner='convert')
+            jobs, task_id = self.enqueue(preparer, file_url, runner='convert')
         except ConnectionError:
             abort(500, 'modeling server error')
 
-        return self.save(task_id, TaskType.MODELING, TaskStatus.PREPARING, [job_id]), 201
+        return self.save(task_id, TaskType.MODELING, TaskStatus.PREPARING, jobs), 201
 
 
 class BatchDownload(MethodView):
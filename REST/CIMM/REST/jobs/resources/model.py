@@ -60,11 +60,11 @@ class AvailableModels(JobMixin):
 
         if structures:
             try:
-                job_id, task_id = self.enqueue(preparer, structures)
+                jobs, task_id = self.enqueue(preparer, structures)
             except ConnectionError:
                 abort(500, 'modeling server error')
 
-            self.save(task_id, TaskType.MODELING, TaskStatus.PREPARING, [job_id])
+            self.save(task_id, TaskType.MODELING, TaskStatus.PREPARING, jobs)
 
             while True:
                 sleep(3)
@@ -67,7 +67,7 @@ class Prepare(PrepareMetadata):
         type: data type = {4.value} [{4.name}] - plain text information
         value: string - body
         """
-        return self.fetch(task, TaskStatus.PREPARED, page), 200
+        return self.fetch(task, TaskStatus.PREPARED, page, serialize=True), 200
 
     @use_kwargs(PreparingDocumentSchema(many=True), locations=('json',))
     @marshal_with(MetadataSchema, 201, 'revalidation task created')
@@ -138,8 +138,8 @@ class Prepare(PrepareMetadata):
             abort(422, 'invalid structure data')
 
         try:
-            job_id, task_id = self.enqueue(preparer, need_preparing)
+            jobs, task_id = self.enqueue(preparer, need_preparing)
         except ConnectionError:
             abort(500, 'modeling server error')
 
-        return self.save(task_id, task['type'], TaskStatus.PREPARING, [job_id], ready_modeling), 201
+        return self.save(task_id, task['type'], TaskStatus.PREPARING, jobs, ready_modeling), 201
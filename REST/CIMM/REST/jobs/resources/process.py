@@ -17,10 +17,14 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from collections import defaultdict
+from flask import Response, stream_with_context
 from flask_apispec import use_kwargs, marshal_with, doc
+from json import dumps
+from pony.orm import db_session
 from uuid import uuid4
 from .common import dynamic_docstring, JobMixin
-from ..marshal import ProcessingDocumentSchema, MetadataSchema, ProcessedSchema, ExtendedMetadataSchema
+from ..export import export, mimetypes
+from ..marshal import ProcessingDocumentSchema, MetadataSchema, ProcessedSchema, ExtendedProcessedMetadataSchema
 from ...utils import abort
 from ....constants import TaskStatus, StructureStatus, TaskType
 
@@ -30,13 +34,16 @@ from ....constants import TaskStatus, StructureStatus, TaskType
 @marshal_with(None, 500, 'modeling/dispatcher server error')
 @marshal_with(None, 512, 'task not ready')
 class ProcessMetadata(JobMixin):
-    @marshal_with(ExtendedMetadataSchema, 200, 'processed task')
+    @marshal_with(ExtendedProcessedMetadataSchema, 200, 'processed task')
     @marshal_with(None, 404, 'invalid task id/status')
     def get(self, task):
         """
         get task metadata
+
+        metadata available after merging of results of first finished job. progress contains amount of pending jobs
+        of models.
         """
-        return self.fetch_meta(task, TaskStatus.PROCESSED), 200
+        return self.fetch_meta(task, TaskStatus.PROCESSED, partial=True), 200
 
 
 class Process(ProcessMetadata):
@@ -49,8 +56,11 @@ class Process(ProcessMetadata):
 
         all structures include models with results lists.
         failed models contain empty results lists.
+
+        structures available after merging of results of first finished job. pending contains ids of models which
+        results of structure not ready yet. structures without ready results of any model not included.
         """
-        return self.fetch(task, TaskStatus.PROCESSED, page), 200
+        return self.fetch(task, TaskStatus.PROCESSED, page, partial=True, serialize=True), 200
 
     @use_kwargs(ProcessingDocumentSchema(many=True), locations=('json',))
     @marshal_with(MetadataSchema, 201, 'processing task created')
@@ -97,14 +107,68 @@ class Process(ProcessMetadata):
             abort(422, 'invalid data')
 
         task_id = str(uuid4())
-        jobs = []
+        jobs, requested = [], defaultdict(list)
         for m, d in ready_modeling.items():
             try:
-                jobs.append(self.enqueue(m, d, task_id=task_id)[0])
+                jobs.extend(self.enqueue(m, d, task_id=task_id)[0])
             except ConnectionError:
-                pass
+                continue
+            for ps in d:
+                requested[ps['structure']].append(m.id)
 
         if not jobs:
             abort(500, 'modeling server error. all models not accessible')
 
-        return self.save(task_id, task['type'], TaskStatus.PROCESSING, jobs), 201
+        return self.save(task_id, task['type'], TaskStatus.PROCESSING, jobs, requested=dict(requested)), 201
+
+
+@doc(params={'task': {'description': 'task id', 'type': 'string'}})
+@marshal_with(None, 403, 'user access deny')
+@marshal_with(None, 500, 'modeling/dispatcher server error')
+@marshal_with(None, 512, 'task not ready')
+class ProcessStream(JobMixin):
+    @marshal_with(None, 200, 'processed structures in NDJSON format', apply=False)
+    @marshal_with(None, 404, 'invalid task id/status')
+    def get(self, task):
+        """
+        Stream of structures with results of processing
+
+        one json of structure per line in order of pages. structures are in format of processed task structures.
+        """
+        _, chunks = self.fetch_chunks(task, TaskStatus.PROCESSED)
+        schema = ProcessingDocumentSchema()
+
+        def generate():
+            for chunk in chunks:
+                with db_session:  # models of results loaded from db
+                    yield ''.join(dumps(schema.dump(s)) + '\n' for s in chunk)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@doc(params={'task': {'description': 'task id', 'type': 'string'},
+             '_format': {'description': 'file format: sdf, rdf or csv', 'type': 'string'}})
+@marshal_with(None, 403, 'user access deny')
+@marshal_with(None, 500, 'modeling/dispatcher server error')
+@marshal_with(None, 512, 'task not ready')
+class ProcessExport(JobMixin):
+    @marshal_with(None, 200, 'processed structures file', apply=False)
+    @marshal_with(None, 404, 'invalid task id/status')
+    def get(self, task, _format):
+        """
+        File of structures with results of processing
+
+        conditions of structures written to SDF/RDF in format of batch upload. text results of models written as \
+        fields named {model name}.{result key}. only molecules written to SDF.
+        CSV contains one row per text result of structure.
+        """
+        _, chunks = self.fetch_chunks(task, TaskStatus.PROCESSED)
+        schema = ProcessingDocumentSchema(exclude=('data',))
+
+        def documents():
+            for chunk in chunks:
+                with db_session:  # models of results loaded from db
+                    yield [dict(schema.dump(s), data=s['data']) for s in chunk]
+
+        return Response(stream_with_context(export(documents(), _format)), mimetype=mimetypes[_format],
+                        headers={'Content-Disposition': f'attachment; filename={task}.{_format}'})
@@ -16,13 +16,14 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from flask import current_app
+from flask import current_app, Response, stream_with_context
 from flask_apispec import MethodResource, use_kwargs, marshal_with, doc
 from flask_login import login_required, current_user
 from marshmallow.fields import String
 from math import ceil
 from pony.orm import db_session
 from .common import JobMixin
+from ..export import export, mimetypes
 from ..marshal import (SavedMetadataSchema, SavedSchema, ProcessingDocumentSchema, SavedListSchema, CountSchema,
                        ExtendedSavedMetadataSchema)
 from .. import database
@@ -107,6 +108,24 @@ class Saved(SavedMetadata):
         return task, 202
 
 
+@doc(params={'_format': {'description': 'file format: sdf, rdf or csv', 'type': 'string'}})
+class SavedExport(SavedMetadata):
+    @marshal_with(None, 200, 'saved structures file', apply=False)
+    def get(self, task, _format):
+        """
+        File of structures with modeling results
+
+        conditions of structures written to SDF/RDF in format of batch upload. text results of models written as \
+        fields named {model name}.{result key}. only molecules written to SDF.
+        CSV contains one row per text result of structure.
+        """
+        data = self.fetch(task).data
+        ps = self.page_size
+        chunks = (data[x: x + ps] for x in range(0, len(data), ps))
+        return Response(stream_with_context(export(chunks, _format)), mimetype=mimetypes[_format],
+                        headers={'Content-Disposition': f'attachment; filename={task}.{_format}'})
+
+
 class SavedList(JobMixin, SavedCount):
     @doc(params={'page': {'description': 'page number', 'type': 'integer'}})
     @marshal_with(SavedListSchema(many=True), 200, 'saved tasks')
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2018 Ramil Nugmanov <stsouko@live.ru>
+#  This file is part of CIMM (ChemoInformatics Models Manager).
+#
+#  CIMM is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from flask_apispec import marshal_with
+from .common import JobMixin
+from ...utils import admin
+
+
+class CodecStats(JobMixin):
+    @admin
+    @marshal_with(None, 200, 'compression statistics', apply=False)
+    @marshal_with(None, 403, 'access denied')
+    def get(self):
+        """
+        Get compression statistics
+
+        amount of compressed and decompressed chunks, sizes before and after compression, compression ratio and \
+        cpu time in seconds spent by all API and job monitor processes.
+        """
+        return self.storage.codec_stats(), 200
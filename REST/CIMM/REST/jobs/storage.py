@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2018 Ramil Nugmanov <stsouko@live.ru>
+#  This file is part of CIMM (ChemoInformatics Models Manager).
+#
+#  CIMM is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from collections import defaultdict
+from operator import itemgetter
+from redis import ResponseError
+from .codec import dumps, flush_stats, loads, stats
+from .utils import chunk_id, chunks_fills, update_chunks
+
+
+class BlobLayout:
+    """
+    task header with structure to chunk mapping stored in one key. chunks stored in separate keys
+    """
+    name = 'blob'
+
+    def __init__(self, redis, size=50, ttl=86400):
+        self.redis = redis
+        self.size = size
+        self.ttl = ttl
+
+    def save(self, task_id, task, data=None):
+        tmp, fills, partial = {}, {}, None
+        with self.redis.pipeline() as pipe:  # task and chunks stored atomically in one request
+            for _id, chunk in self._split(task_id, data):
+                pipe.set(_id, dumps(chunk), ex=self.ttl)
+                for s in chunk:
+                    tmp[s] = _id
+                fills[_id] = len(chunk)
+                partial = _id if len(chunk) < self.size else None
+
+            pipe.set(task_id, dumps({'chunks': tmp, 'fills': fills, 'partial': partial, **task}), ex=self.ttl)
+            pipe.execute()
+
+    def get(self, task_id):
+        task = self.redis.get(task_id)
+        if task is not None:
+            task = loads(task)
+            task['layout'] = self.name
+            return task
+
+    def get_chunks(self, task, chunks):
+        return [loads(x) for x in self.redis.mget(chunks)] if chunks else []
+
+    def update(self, task, jobs, lost=()):
+        task_id = task['task']
+        ids = {x.id for x in jobs}.union(lost)
+
+        def merge(pipe):
+            task = pipe.get(task_id)
+            if task is None:  # task expired
+                return
+
+            task = loads(task)
+            pending = {x[2] for x in task['jobs']}
+            finished = [x for x in jobs if x.id in pending and x.is_finished]  # skip already merged jobs
+            chunks = task['chunks']
+            _, partial = chunks_fills(task, self.size)
+            c_ids = {chunks[s['structure']] for x in finished for s in x.result if s['structure'] in chunks}
+            if partial:
+                c_ids.add(partial)
+            c_ids = list(c_ids)
+            loaded_chunks = dict(zip(c_ids, map(loads, pipe.mget(c_ids)))) if c_ids else {}
+
+            for job in finished:
+                update_chunks(task, job, loaded_chunks, self.size)
+                if job.ended_at > task['date']:
+                    task['date'] = job.ended_at
+            task['jobs'] = [x for x in task['jobs'] if x[2] not in ids]
+
+            pipe.multi()
+            for c_id, chunk in loaded_chunks.items():
+                pipe.set(c_id, dumps(chunk), ex=self.ttl)
+            pipe.set(task_id, dumps(task), ex=self.ttl)
+            return task['jobs']
+
+        # chunks changed only with header. watching of header is enough
+        return self.redis.transaction(merge, task_id, value_from_callable=True)
+
+    def _split(self, task_id, data):
+        if data:
+            for n, x in enumerate(range(0, len(data), self.size)):  # store structures in chunks.
+                yield chunk_id(task_id, n), {s['structure']: s for s in data[x: x + self.size]}
+
+
+class HashLayout(BlobLayout):
+    """
+    task header stored in hash. structure to chunk mapping and chunk fills stored in {task}:chunks and {task}:fills
+    hashes. chunks are hashes with structure id fields and {structure id}:{model id} fields of models results.
+
+    job completion only adds fields of new structures and results.
+    """
+    name = 'hash'
+
+    def save(self, task_id, task, data=None):
+        tmp, fills, partial = {}, {}, None
+        with self.redis.pipeline() as pipe:
+            for _id, chunk in self._split(task_id, data):
+                pipe.hset(_id, mapping={s_id: dumps(s) for s_id, s in chunk.items()})
+                pipe.expire(_id, self.ttl)
+                for s in chunk:
+                    tmp[s] = _id
+                fills[_id] = len(chunk)
+                partial = _id if len(chunk) < self.size else None
+
+            pipe.hset(task_id, mapping={k: dumps(v) for k, v in {'partial': partial, **task}.items()})
+            pipe.expire(task_id, self.ttl)
+            if tmp:
+                pipe.hset(f'{task_id}:chunks', mapping=tmp)
+                pipe.hset(f'{task_id}:fills', mapping=fills)
+                pipe.expire(f'{task_id}:chunks', self.ttl)
+                pipe.expire(f'{task_id}:fills', self.ttl)
+            pipe.execute()
+
+    def get(self, task_id):
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(task_id)
+            pipe.hgetall(f'{task_id}:chunks')
+            pipe.hgetall(f'{task_id}:fills')
+            header, chunks, fills = pipe.execute()
+
+        if header:
+            task = {k.decode(): loads(v) for k, v in header.items()}
+            task['chunks'] = {int(k): v.decode() for k, v in chunks.items()}
+            task['fills'] = {k.decode(): int(v) for k, v in fills.items()}
+            task['layout'] = self.name
+            return task
+
+    def get_chunks(self, task, chunks):
+        with self.redis.pipeline(transaction=False) as pipe:
+            for c_id in chunks:
+                pipe.hgetall(c_id)
+            return [self.__decode(x) for x in pipe.execute()]
+
+    def update(self, task, jobs, lost=()):
+        task_id = task['task']
+        ids = {x.id for x in jobs}.union(lost)
+
+        def merge(pipe):
+            header = pipe.hmget(task_id, 'jobs', 'date', 'partial')
+            if header[0] is None:  # task expired
+                return
+
+            task_jobs, date, partial = map(loads, header)
+            pending = {x[2] for x in task_jobs}
+            finished = [x for x in jobs if x.id in pending and x.is_finished]  # skip already merged jobs
+            s_ids = list({s['structure'] for x in finished for s in x.result})
+            chunks = {k: v.decode() for k, v in zip(s_ids, pipe.hmget(f'{task_id}:chunks', s_ids))
+                      if v is not None} if s_ids else {}
+            fill = partial and int(pipe.hget(f'{task_id}:fills', partial) or 0)
+
+            new_chunks, new_fills, fields, created = {}, {}, defaultdict(dict), None
+            for job in finished:
+                model = job.meta['model']
+                for s in job.result:
+                    s_id = s['structure']
+                    c_id = chunks.get(s_id)
+                    if c_id is None:
+                        if not partial:
+                            if created is None:
+                                created = pipe.hlen(f'{task_id}:fills')
+                            partial = chunk_id(task_id, created)
+                            created += 1
+                            fill = 0
+                        c_id = chunks[s_id] = new_chunks[s_id] = partial
+                        fill += 1
+                        new_fills[partial] = fill
+                        fields[c_id][s_id] = dumps({**{k: v for k, v in s.items() if k != 'results'}, 'models': []})
+                        if fill == self.size:
+                            partial = None
+                    fields[c_id][f'{s_id}:{model}'] = dumps(s.get('results', []))
+
+                if job.ended_at > date:
+                    date = job.ended_at
+            task_jobs = [x for x in task_jobs if x[2] not in ids]
+
+            pipe.multi()
+            for c_id, f in fields.items():
+                pipe.hset(c_id, mapping=f)
+                pipe.expire(c_id, self.ttl)
+            if new_chunks:
+                pipe.hset(f'{task_id}:chunks', mapping=new_chunks)
+                pipe.hset(f'{task_id}:fills', mapping=new_fills)
+            pipe.hset(task_id, mapping={'jobs': dumps(task_jobs), 'date': dumps(date), 'partial': dumps(partial)})
+            for key in (task_id, f'{task_id}:chunks', f'{task_id}:fills'):
+                pipe.expire(key, self.ttl)
+            return task_jobs
+
+        # mapping and fills changed only with header. watching of header is enough
+        return self.redis.transaction(merge, task_id, value_from_callable=True)
+
+    @staticmethod
+    def __decode(chunk):
+        structures, models = {}, defaultdict(list)
+        for k, v in chunk.items():
+            s_id, _, m_id = k.decode().partition(':')
+            if m_id:
+                models[int(s_id)].append({'results': loads(v), 'model': int(m_id)})
+            else:
+                structures[int(s_id)] = loads(v)
+
+        for s_id, s in structures.items():
+            s['models'].extend(sorted(models[s_id], key=itemgetter('model')))
+        return structures
+
+
+class TaskStorage:
+    """
+    storage of tasks in redis. new tasks saved in given layout. tasks in any layout are loadable
+    """
+    def __init__(self, redis, layout='blob', size=50, ttl=86400):
+        self.__redis = redis
+        self.__ttl = ttl
+        self.__layouts = {x.name: x(redis, size, ttl) for x in (BlobLayout, HashLayout)}
+        try:
+            self.__layout = self.__layouts[layout]
+        except KeyError:
+            raise ValueError(f"layout '{layout}' not available")
+
+    def save(self, task_id, task, data=None):
+        """
+        store new task
+
+        :param task: task header dict
+        :param data: list of structures
+        """
+        self.__layout.save(task_id, task, data)
+        flush_stats(self.__redis)
+
+    def get(self, task_id):
+        """
+        get task header with structures to chunks mapping
+        """
+        try:
+            return self.__layout.get(task_id)
+        except ResponseError:  # task stored in other layout
+            for layout in self.__layouts.values():
+                if layout is not self.__layout:
+                    try:
+                        return layout.get(task_id)
+                    except ResponseError:
+                        continue
+            raise
+
+    def get_chunks(self, task, chunks):
+        """
+        get list of chunks dicts of structures
+        """
+        chunks = self.__layouts[task['layout']].get_chunks(task, chunks)
+        flush_stats(self.__redis)
+        return chunks
+
+    def update(self, task, jobs, lost=()):
+        """
+        atomically merge results of finished jobs into task and remove jobs from task.
+        jobs already merged by concurrent consumers are skipped.
+
+        :param jobs: finished or failed jobs
+        :param lost: ids of jobs removed from queues
+        :return: list of pending jobs of task. None if task expired
+        """
+        jobs = self.__layouts[task['layout']].update(task, jobs, lost)
+        flush_stats(self.__redis)
+        return jobs
+
+    def get_serialized(self, chunks):
+        """
+        get serialized structures of chunks. data of structures in chunks never changed
+
+        :return: list of dicts of structure id: MRV string
+        """
+        with self.__redis.pipeline(transaction=False) as pipe:
+            for c_id in chunks:
+                pipe.hgetall(f'{c_id}:mrv')
+            return [{int(k): v.decode() for k, v in x.items()} for x in pipe.execute()]
+
+    def set_serialized(self, serialized):
+        """
+        store serialized structures
+
+        :param serialized: dict of chunk id: dict of structure id: MRV string
+        """
+        with self.__redis.pipeline(transaction=False) as pipe:
+            for c_id, structures in serialized.items():
+                pipe.hset(f'{c_id}:mrv', mapping=structures)
+                pipe.expire(f'{c_id}:mrv', self.__ttl)
+            pipe.execute()
+
+    def heartbeat(self, ttl):
+        """
+        mark tasks as monitored for ttl seconds. monitor merges results of jobs
+        """
+        self.__redis.set('cimm:monitor', 1, ex=ttl)
+        flush_stats(self.__redis)
+
+    def codec_stats(self):
+        """
+        compression statistics of all processes used storage
+        """
+        return stats(self.__redis)
+
+    def monitored(self):
+        """
+        check for alive monitor. pending jobs of tasks are merged by monitor and don't require inspection
+        """
+        return bool(self.__redis.exists('cimm:monitor'))
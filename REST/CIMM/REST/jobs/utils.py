@@ -17,36 +17,52 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from collections import Counter
-from pickle import dumps, loads
-from uuid import uuid4
 
 
-def update_chunks(chunks, job, redis, size, ttl):
-    partial_chunk = next((c_id for c_id, fill in Counter(chunks.values()).items() if fill < size), None)
+def chunk_id(task_id, n):
+    """
+    id of n-th chunk of task. sorting of ids keeps order of chunks creation
+    """
+    return f'{task_id}:{n:08}'
+
+
+def chunks_fills(task, size):
+    """
+    get amount of structures in chunks of task and id of partially filled chunk
+    """
+    fills = task.get('fills')
+    if fills is None:  # task created by previous version
+        task['fills'] = fills = dict(Counter(task['chunks'].values()))
+        task['partial'] = next((c_id for c_id, fill in fills.items() if fill < size), None)
+    return fills, task['partial']
+
+
+def update_chunks(task, job, loaded_chunks, size):
+    """
+    merge results of finished job into loaded chunks. new chunks added to loaded chunks dict
+    """
+    chunks = task['chunks']
+    fills, partial_chunk = chunks_fills(task, size)
     model = job.meta['model']
 
-    loaded_chunks = {}
     for s in job.result:
+        s = s.copy()  # job result is reusable on merge retry
         results = dict(results=s.pop('results', []), model=model)
         s_id = s['structure']
         if s_id in chunks:
-            c_id = chunks[s_id]
-            ch = loaded_chunks.get(c_id) or loaded_chunks.setdefault(c_id, loads(redis.get(c_id)))
-            ch[s_id]['models'].append(results)
+            loaded_chunks[chunks[s_id]][s_id]['models'].append(results)
         else:
-            if partial_chunk:
-                ch = loaded_chunks.get(partial_chunk) or \
-                     loaded_chunks.setdefault(partial_chunk, loads(redis.get(partial_chunk)))
-            else:
-                partial_chunk = str(uuid4())
-                ch = loaded_chunks[partial_chunk] = {}
+            if not partial_chunk:
+                partial_chunk = chunk_id(task['task'], len(fills))
+                loaded_chunks[partial_chunk] = {}
+                fills[partial_chunk] = 0
 
             s['models'] = [results]
-            ch[s_id] = s
+            loaded_chunks[partial_chunk][s_id] = s
             chunks[s_id] = partial_chunk
+            fills[partial_chunk] += 1
 
-            if len(ch) == size:
+            if fills[partial_chunk] == size:
                 partial_chunk = None
 
-    for c_id, chunk in loaded_chunks.items():
-        redis.set(c_id, dumps(chunk), ex=ttl)
+    task['partial'] = partial_chunk
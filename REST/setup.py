@@ -26,8 +26,10 @@ setup(
     version=version(),
     packages=['CIMM.CLI', 'CIMM.REST', 'CIMM.REST.jobs', 'CIMM.REST.jobs.marshal', 'CIMM.REST.jobs.resources'],
     install_requires=['CIMM-CORE>=1.4.3,<1.5', 'pony>=0.7.6,<0.8', 'flask>=1.0.2,<1.1', 'flask_apispec>=0.7.0,<0.8',
-                      'flask_login>=0.4.1,<0.5', 'rq>=0.12.0,<0.13', 'marshmallow>=3.0.0b16,<3.1'],
-    extras_require={'autocomplete': ['argcomplete'], 'sphinx': ['sphinx>=1.6']},
+                      'flask_login>=0.4.1,<0.5', 'rq>=1.10,<2', 'marshmallow>=3.0.0b16,<3.1',
+                      'redis>=4.2,<5'],
+    extras_require={'autocomplete': ['argcomplete'], 'sphinx': ['sphinx>=1.6'], 'msgpack': ['msgpack>=0.6.1'],
+                    'lz4': ['lz4'], 'zstd': ['zstandard']},
     zip_safe=False,
     url='https://github.com/stsouko/ModelManager',
     license='AGPLv3',
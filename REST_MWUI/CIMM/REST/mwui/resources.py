@@ -73,7 +73,7 @@ class ExampleView(JobMixin, MethodView):
         task_id = str(uuid4())
 
         try:
-            jobs = [self.enqueue(model, [model.example])[0]]
+            jobs = self.enqueue(model, [model.example])[0]
         except ConnectionError:
             abort(500, 'modeling server error')
 